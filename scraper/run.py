@@ -20,21 +20,30 @@ Outputs:
 - SQLite database: ../data/transfermap.db
 - JSON snapshots: ../data/schools/{school-slug}.json
 - Debug HTML: ../data/debug_*.html (when errors occur)
+
+Database writes use SQLite with synchronous=OFF for speed. A crash mid-run can
+lose the most recent commits; re-run the scraper (optionally filtered to the
+affected school) to restore them, since all writes are idempotent upserts.
 """
 
 import os
 import sys
 import time
-import json
 import sqlite3
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 from urllib.parse import urljoin, urlparse
 from typing import Dict, List, Optional, Tuple, Any
 import logging
 
+import lxml.etree
+import lxml.html
+import orjson
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from bs4 import BeautifulSoup, SoupStrainer
 from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
 from tqdm import tqdm
 from dotenv import load_dotenv
@@ -52,6 +61,8 @@ RETRY_MAX = int(os.getenv('RETRY_MAX', '3'))
 RETRY_BACKOFF_SECONDS = float(os.getenv('RETRY_BACKOFF_SECONDS', '2'))
 USER_AGENT = os.getenv('USER_AGENT', 'TransferMapGT/0.1 (student project; contact: myemail@example.com)')
 DB_PATH = os.getenv('DB_PATH', '../data/transfermap.db')
+SUBJECT_WORKERS = int(os.getenv('SUBJECT_WORKERS', '4'))
+SCHOOL_WORKERS = int(os.getenv('SCHOOL_WORKERS', '2'))
 
 # Optional filters for testing
 SCHOOL_NAME_FILTER = os.getenv('SCHOOL_NAME_FILTER')
@@ -61,32 +72,112 @@ SUBJECT_PREFIX_FILTER = os.getenv('SUBJECT_PREFIX_FILTER')
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# Rate limiting
-REQUEST_INTERVAL = 60.0 / REQUESTS_PER_MINUTE  # seconds between requests
+# Precompiled patterns for course code normalization and slugs
+_GT_CODE_RE = re.compile(r'([A-Za-z]+)(\d+)')
+_SLUG_NONWORD_RE = re.compile(r'[^\w\s-]')
+_SLUG_DASH_RE = re.compile(r'[-\s]+')
+
+# SQL statements, kept in one place for readability and reuse
+SQL_INSERT_SCHOOL = "INSERT OR IGNORE INTO School (name) VALUES (?)"
+SQL_SELECT_SCHOOL_ID = "SELECT id FROM School WHERE name = ?"
+SQL_INSERT_GT_COURSE = """
+    INSERT OR IGNORE INTO GTCourse (code, title, creditHours)
+    VALUES (?, ?, ?)
+"""
+SQL_SELECT_GT_COURSE_ID = "SELECT id FROM GTCourse WHERE code = ?"
+SQL_INSERT_EXTERNAL_COURSE = """
+    INSERT OR IGNORE INTO ExternalCourse (schoolId, code, title, creditHours)
+    VALUES (?, ?, ?, ?)
+"""
+SQL_UPSERT_EQUIVALENCY = """
+    INSERT INTO Equivalency (gtCourseId, schoolId, externalCourseCode, semester)
+    VALUES (?, ?, ?, ?)
+    ON CONFLICT(gtCourseId, schoolId, externalCourseCode)
+    DO UPDATE SET semester = excluded.semester
+"""
+
+# Form steps only need the <form> elements of each page
+FORM_STRAINER = SoupStrainer('form')
+
+
+class ScraperStopped(Exception):
+    """Raised in worker threads once the scraper has been told to stop."""
+
+
+class RateLimiter:
+    """Thread-safe token bucket: allows bursts up to max_rate, refills at max_rate per time_period."""
+    
+    def __init__(self, max_rate: float, time_period: float = 60.0,
+                 stop_event: Optional[threading.Event] = None):
+        self.stop_event = stop_event or threading.Event()
+        self.capacity = max_rate
+        self.refill_rate = max_rate / time_period  # tokens per second
+        self.tokens = float(max_rate)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+    
+    def acquire(self):
+        """Block until a token is available, then consume it; raises ScraperStopped once stop_event is set."""
+        while True:
+            if self.stop_event.is_set():
+                raise ScraperStopped("Scraper is stopping")
+            
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.refill_rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_time = (1 - self.tokens) / self.refill_rate
+            # Wake immediately if the scraper is stopped while waiting for a token
+            self.stop_event.wait(wait_time)
+    
+    def __enter__(self):
+        self.acquire()
+        return self
+    
+    def __exit__(self, *exc_info):
+        return False
 
 
 class TransferMapScraper:
     def __init__(self):
         self.session = requests.Session()
+        # Keep requests' default Accept-Encoding: it already lists every coding
+        # urllib3 can decode, including br when brotli is installed
         self.session.headers.update({'User-Agent': USER_AGENT})
-        self.last_request_time = 0
+        
+        # Keep one persistent connection per worker to the single host we scrape;
+        # retries are handled by tenacity in fetch()
+        base = urlparse(BASE_URL)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(16, SCHOOL_WORKERS + SUBJECT_WORKERS), max_retries=0)
+        self.session.mount(f'{base.scheme}://{base.netloc}/', adapter)
+        # Set when run() is interrupted or fails, so workers stop spending the request budget
+        self.stop_event = threading.Event()
+        self.limiter = RateLimiter(REQUESTS_PER_MINUTE, 60, self.stop_event)
+        
+        # Equivalency table column layout per school: school_value -> (header width, column indices)
+        self._header_cache: Dict[str, Tuple[int, Tuple]] = {}
         
         # Ensure output directories exist
         Path('../data').mkdir(exist_ok=True)
         Path('../data/schools').mkdir(exist_ok=True)
         
+        # Single connection for the whole run; writes are committed per school.
+        # Durability is relaxed for bulk loading (synchronous=OFF): every write is
+        # an idempotent upsert, so if the process or machine dies mid-run, re-running
+        # the scraper (or just the affected school) repairs the database.
+        self.conn = sqlite3.connect(DB_PATH)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=OFF")
+        self.conn.execute("PRAGMA temp_store=MEMORY")
+        self.conn.execute("PRAGMA cache_size=-65536")  # 64 MiB page cache
+        self.conn.execute("PRAGMA mmap_size=268435456")  # 256 MiB memory-mapped I/O
+        
         # Initialize database
         self.ensure_schema()
     
-    def throttle(self):
-        """Rate limiting: ensure minimum interval between requests."""
-        current_time = time.time()
-        time_since_last = current_time - self.last_request_time
-        if time_since_last < REQUEST_INTERVAL:
-            sleep_time = REQUEST_INTERVAL - time_since_last
-            time.sleep(sleep_time)
-        self.last_request_time = time.time()
-    
     @retry(
         stop=stop_after_attempt(RETRY_MAX),
         wait=wait_exponential(multiplier=RETRY_BACKOFF_SECONDS),
@@ -94,16 +185,19 @@ class TransferMapScraper:
     )
     def fetch(self, method: str, url: str, **kwargs) -> requests.Response:
         """Fetch with retries and rate limiting."""
-        self.throttle()
-        
         try:
-            response = self.session.request(method, url, timeout=30, **kwargs)
+            # The limiter raises ScraperStopped before handing out a token once stopped
+            with self.limiter:
+                response = self.session.request(method, url, timeout=30, **kwargs)
+            
+            logger.debug(f"{method} {url}: {response.status_code}, "
+                         f"Content-Encoding={response.headers.get('Content-Encoding', 'identity')}")
             
             # Handle HTTP 429 (Too Many Requests)
             if response.status_code == 429:
                 retry_after = int(response.headers.get('Retry-After', 60))
                 logger.warning(f"Rate limited, sleeping {retry_after} seconds")
-                time.sleep(retry_after)
+                self.stop_event.wait(retry_after)
                 raise requests.RequestException("Rate limited")
             
             response.raise_for_status()
@@ -120,6 +214,10 @@ class TransferMapScraper:
             f.write(content)
         logger.error(f"Debug HTML saved to {debug_path}")
     
+    def _soup(self, content, parse_only: Optional[SoupStrainer] = None) -> BeautifulSoup:
+        """Parse HTML into BeautifulSoup using the lxml parser."""
+        return BeautifulSoup(content, 'lxml', parse_only=parse_only)
+    
     def first_form(self, soup: BeautifulSoup) -> Optional[BeautifulSoup]:
         """Find the first form on the page."""
         return soup.find('form')
@@ -129,24 +227,23 @@ class TransferMapScraper:
         action = form.get('action', '')
         post_url = urljoin(current_url, action)
         
-        # Start with all hidden inputs
+        # Collect hidden inputs and default select values in one walk of the form
         data = {}
-        for hidden in form.find_all('input', type='hidden'):
-            name = hidden.get('name')
-            value = hidden.get('value', '')
-            if name:
-                data[name] = value
-        
-        # Add default select values
-        for select in form.find_all('select'):
-            name = select.get('name')
-            if name and name not in overrides:
-                selected = select.find('option', selected=True)
+        for elem in form.find_all(['input', 'select']):
+            name = elem.get('name')
+            if not name:
+                continue
+            
+            if elem.name == 'input':
+                if elem.get('type') == 'hidden':
+                    data[name] = elem.get('value', '')
+            elif name not in overrides:
+                selected = elem.find('option', selected=True)
                 if selected:
                     data[name] = selected.get('value', '')
                 else:
                     # Use first option if none selected
-                    first_option = select.find('option')
+                    first_option = elem.find('option')
                     if first_option:
                         data[name] = first_option.get('value', '')
         
@@ -155,6 +252,16 @@ class TransferMapScraper:
         
         return post_url, data
     
+    def _find_submit(self, form: BeautifulSoup, keywords: Tuple[str, ...]) -> Dict[str, str]:
+        """Find the first submit button whose value contains any keyword; returns {name: value} or {}."""
+        button = form.find('input', attrs={
+            'type': 'submit',
+            'value': lambda value: bool(value) and any(keyword in value.lower() for keyword in keywords),
+        })
+        if not button:
+            return {}
+        return {button.get('name', ''): button.get('value', '')}
+    
     def select_option_by_text(self, form: BeautifulSoup, option_text: str) -> Optional[Tuple[str, str]]:
         """Find select and option value by visible text."""
         for select in form.find_all('select'):
@@ -187,20 +294,28 @@ class TransferMapScraper:
         return largest_select
     
     def find_school_select(self, form: BeautifulSoup) -> Optional[BeautifulSoup]:
-        """Find the school select by name pattern or size."""
-        # First try by name pattern
+        """Find the school select by name pattern or size, in a single pass over the selects."""
+        largest_select = None
+        max_options = 0
+        
         for select in form.find_all('select'):
+            # Prefer a select whose name looks like a school field
             name = select.get('name', '').lower()
-            if any(keyword in name for keyword in ['school', 'inst', 'college', 'univ']):
+            if any(keyword in name for keyword in ('school', 'inst', 'college', 'univ')):
                 return select
+            
+            # Track the largest select as the fallback
+            option_count = len(select.find_all('option'))
+            if option_count > max_options:
+                max_options = option_count
+                largest_select = select
         
-        # Fallback to largest select
-        return self.find_largest_select(form)
+        return largest_select
     
     def step_us_yes(self, start_url: str) -> str:
         """Step 1: Answer 'Yes' to US institution question."""
         response = self.fetch('GET', start_url)
-        soup = BeautifulSoup(response.content, 'html.parser')
+        soup = self._soup(response.content, FORM_STRAINER)
         
         form = self.first_form(soup)
         if not form:
@@ -208,11 +323,7 @@ class TransferMapScraper:
             raise Exception("Could not find form for US question")
         
         # Find submit button with "Yes"
-        submit_data = {}
-        for input_elem in form.find_all('input', type='submit'):
-            if 'yes' in input_elem.get('value', '').lower():
-                submit_data[input_elem.get('name', '')] = input_elem.get('value', '')
-                break
+        submit_data = self._find_submit(form, ('yes',))
         
         post_url, data = self.build_post(form, submit_data, response.url)
         response = self.fetch('POST', post_url, data=data)
@@ -222,7 +333,7 @@ class TransferMapScraper:
     def step_choose_state(self, current_url: str) -> str:
         """Step 2: Choose the state."""
         response = self.fetch('GET', current_url)
-        soup = BeautifulSoup(response.content, 'html.parser')
+        soup = self._soup(response.content, FORM_STRAINER)
         
         form = self.first_form(soup)
         if not form:
@@ -239,11 +350,7 @@ class TransferMapScraper:
         
         # Find submit button
         submit_data = {state_name: state_value}
-        for input_elem in form.find_all('input', type='submit'):
-            value = input_elem.get('value', '').lower()
-            if 'state' in value or 'get' in value:
-                submit_data[input_elem.get('name', '')] = input_elem.get('value', '')
-                break
+        submit_data.update(self._find_submit(form, ('state', 'get')))
         
         post_url, data = self.build_post(form, submit_data, response.url)
         response = self.fetch('POST', post_url, data=data)
@@ -253,7 +360,7 @@ class TransferMapScraper:
     def step_list_schools(self, current_url: str) -> List[Tuple[str, str]]:
         """Step 3: Get list of all schools."""
         response = self.fetch('GET', current_url)
-        soup = BeautifulSoup(response.content, 'html.parser')
+        soup = self._soup(response.content, FORM_STRAINER)
         
         form = self.first_form(soup)
         if not form:
@@ -280,7 +387,7 @@ class TransferMapScraper:
     def step_choose_school(self, current_url: str, school_value: str, school_name: str) -> str:
         """Step 4: Choose a specific school."""
         response = self.fetch('GET', current_url)
-        soup = BeautifulSoup(response.content, 'html.parser')
+        soup = self._soup(response.content, FORM_STRAINER)
         
         form = self.first_form(soup)
         if not form:
@@ -296,21 +403,17 @@ class TransferMapScraper:
         
         # Find submit button
         submit_data = {school_field_name: school_value}
-        for input_elem in form.find_all('input', type='submit'):
-            value = input_elem.get('value', '').lower()
-            if 'school' in value or 'get' in value:
-                submit_data[input_elem.get('name', '')] = input_elem.get('value', '')
-                break
+        submit_data.update(self._find_submit(form, ('school', 'get')))
         
         post_url, data = self.build_post(form, submit_data, response.url)
         response = self.fetch('POST', post_url, data=data)
         
         return response.url
     
-    def step_subject_level_term(self, current_url: str) -> Tuple[str, List[Tuple[str, str]], str, str, str]:
-        """Step 5: Get subjects and prepare level/term selection."""
+    def step_subject_level_term(self, current_url: str) -> Tuple[List[Tuple[str, str]], str, str, Dict[str, str]]:
+        """Step 5: Get subjects and prepare the level/term submission reused for every subject."""
         response = self.fetch('GET', current_url)
-        soup = BeautifulSoup(response.content, 'html.parser')
+        soup = self._soup(response.content, FORM_STRAINER)
         
         form = self.first_form(soup)
         if not form:
@@ -346,89 +449,52 @@ class TransferMapScraper:
             raise Exception(f"Could not find semester '{SEMESTER}'")
         term_field_name, term_value = term_info
         
-        return current_url, subjects, subject_field_name, level_field_name, term_field_name
-    
-    def submit_subject(self, base_url: str, subject_value: str, subject_field_name: str, 
-                      level_field_name: str, term_field_name: str) -> str:
-        """Submit subject selection and get equivalency table."""
-        response = self.fetch('GET', base_url)
-        soup = BeautifulSoup(response.content, 'html.parser')
-        
-        form = self.first_form(soup)
-        if not form:
-            raise Exception("Could not find form for subject submission")
-        
-        # Find level and term values again
-        level_info = self.select_option_by_text(form, LEVEL)
-        term_info = self.select_option_by_text(form, SEMESTER)
-        
-        if not level_info or not term_info:
-            raise Exception("Could not find level or term values")
-        
-        _, level_value = level_info
-        _, term_value = term_info
-        
-        # Build submission data
+        # Build submission data once; only the subject changes per request
         submit_data = {
-            subject_field_name: subject_value,
             level_field_name: level_value,
             term_field_name: term_value
         }
         
         # Find submit button
-        for input_elem in form.find_all('input', type='submit'):
-            value = input_elem.get('value', '').lower()
-            if 'course' in value or 'get' in value or 'submit' in value:
-                submit_data[input_elem.get('name', '')] = input_elem.get('value', '')
-                break
+        submit_data.update(self._find_submit(form, ('course', 'get', 'submit')))
+        
+        post_url, form_data = self.build_post(form, submit_data, response.url)
+        
+        return subjects, subject_field_name, post_url, form_data
+    
+    def submit_subject(self, post_url: str, form_data: Dict[str, str], subject_field_name: str,
+                       subject_value: str) -> bytes:
+        """Submit subject selection and get equivalency table."""
+        data = dict(form_data)
+        data[subject_field_name] = subject_value
         
-        post_url, data = self.build_post(form, submit_data, response.url)
         response = self.fetch('POST', post_url, data=data)
         
-        return response.text
+        return response.content
+    
+    def scrape_subject(self, post_url: str, form_data: Dict[str, str], subject_field_name: str,
+                       subject_value: str, subject_name: str, school_value: str) -> List[Dict[str, Any]]:
+        """Fetch and parse equivalencies for one subject (runs on a worker thread)."""
+        if self.stop_event.is_set():
+            raise ScraperStopped("Scraper is stopping")
+        
+        html_content = self.submit_subject(post_url, form_data, subject_field_name, subject_value)
+        return self.parse_equivalency_table(html_content, subject_name, school_value)
     
     def normalize_gt_course_code(self, code: str) -> str:
         """Normalize GT course code: 'CS1331' -> 'CS 1331', 'BIOS1107L' -> 'BIOS 1107L'."""
         code = code.strip()
         # Insert space between letters and digits
-        normalized = re.sub(r'([A-Za-z]+)(\d+)', r'\1 \2', code)
+        normalized = _GT_CODE_RE.sub(r'\1 \2', code)
         return normalized
     
-    def parse_equivalency_table(self, html_content: str, subject: str) -> List[Dict[str, Any]]:
-        """Parse the final equivalency table."""
-        soup = BeautifulSoup(html_content, 'html.parser')
-        equivalencies = []
-        
-        # Find the main data table
-        # Look for tables with substantial content
-        tables = soup.find_all('table')
-        main_table = None
-        
-        for table in tables:
-            rows = table.find_all('tr')
-            if len(rows) > 2:  # Has header and data rows
-                # Check if this looks like an equivalency table
-                header_row = rows[0] if rows else None
-                if header_row and ('class' in header_row.get_text().lower() or 
-                                  'title' in header_row.get_text().lower()):
-                    main_table = table
-                    break
-        
-        if not main_table:
-            logger.warning(f"Could not find equivalency table for subject {subject}")
-            return equivalencies
-        
-        rows = main_table.find_all('tr')
-        if len(rows) < 2:
-            return equivalencies
-        
-        # Parse header to understand column structure
-        header_row = rows[0]
-        header_cells = header_row.find_all(['th', 'td'])
-        
-        # Find column indices
-        col_headers = [cell.get_text(strip=True).lower() for cell in header_cells]
-        
+    def cell_text(self, cell: lxml.html.HtmlElement) -> str:
+        """Text of an lxml cell, stripped per text node like BeautifulSoup's get_text(strip=True)."""
+        return ''.join(text.strip() for text in cell.itertext())
+    
+    def discover_columns(self, col_headers: List[str]) -> Tuple[Optional[int], Optional[int], Optional[int],
+                                                                Optional[int], List[int]]:
+        """Find external/GT class, title and credit hour column indices from lowercase headers."""
         # Look for key columns
         external_class_idx = None
         external_title_idx = None
@@ -462,19 +528,76 @@ class TransferMapScraper:
                 elif 'title' in header and i >= mid_point and gt_title_idx is None:
                     gt_title_idx = i
         
+        return external_class_idx, external_title_idx, gt_class_idx, gt_title_idx, credit_hours_indices
+    
+    def parse_equivalency_table(self, html_content: bytes, subject: str,
+                                school_value: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Parse the final equivalency table."""
+        # Read-only extraction, so walk the lxml tree directly rather than building BS4 objects
+        equivalencies = []
+        try:
+            doc = lxml.html.fromstring(html_content)
+        except lxml.etree.ParserError:
+            # Empty or whitespace-only body: nothing to parse
+            logger.warning(f"Could not find equivalency table for subject {subject}")
+            return equivalencies
+        
+        # Find the main data table
+        # Look for tables with substantial content
+        main_table = None
+        rows = []
+        
+        for table in doc.iter('table'):
+            # Rows directly under the table or under its thead/tbody/tfoot
+            rows = table.xpath('./tr | ./*/tr')
+            if len(rows) > 2:  # Has header and data rows
+                # Check if this looks like an equivalency table
+                header_text = rows[0].text_content().lower()
+                if 'class' in header_text or 'title' in header_text:
+                    main_table = table
+                    break
+        
+        if main_table is None:
+            logger.warning(f"Could not find equivalency table for subject {subject}")
+            return equivalencies
+        
+        # Parse header to understand column structure
+        header_cells = list(rows[0].iterchildren('th', 'td'))
+        
+        # Column layout is fixed per school, so reuse it while the header width matches
+        cached = self._header_cache.get(school_value) if school_value is not None else None
+        if cached and cached[0] == len(header_cells):
+            columns = cached[1]
+        else:
+            col_headers = [self.cell_text(cell).lower() for cell in header_cells]
+            columns = self.discover_columns(col_headers)
+            if school_value is not None:
+                self._header_cache[school_value] = (len(header_cells), columns)
+        
+        external_class_idx, external_title_idx, gt_class_idx, gt_title_idx, credit_hours_indices = columns
+        
+        # Hoist per-table values out of the row loop
+        cell_text = self.cell_text
+        min_required_cells = max(external_class_idx or 0, gt_class_idx or 0) + 1
+        credit_first_idx = credit_hours_indices[0] if credit_hours_indices else None
+        credit_last_idx = credit_hours_indices[-1] if credit_hours_indices else None
+        has_two_credit_columns = len(credit_hours_indices) >= 2
+        normalize_gt_course_code = self.normalize_gt_course_code
+        append = equivalencies.append
+        
         # Process data rows
         for row in rows[1:]:
-            cells = row.find_all(['td', 'th'])
-            if len(cells) < max(external_class_idx or 0, gt_class_idx or 0) + 1:
+            cells = [cell_text(cell) for cell in row.iterchildren('td', 'th')]
+            if len(cells) < min_required_cells:
                 continue
             
             # Extract external course info
-            external_class = cells[external_class_idx].get_text(strip=True) if external_class_idx is not None else ""
-            external_title = cells[external_title_idx].get_text(strip=True) if external_title_idx is not None else ""
+            external_class = cells[external_class_idx] if external_class_idx is not None else ""
+            external_title = cells[external_title_idx] if external_title_idx is not None else ""
             
             # Extract GT course info
-            gt_class = cells[gt_class_idx].get_text(strip=True) if gt_class_idx is not None else ""
-            gt_title = cells[gt_title_idx].get_text(strip=True) if gt_title_idx is not None else ""
+            gt_class = cells[gt_class_idx] if gt_class_idx is not None else ""
+            gt_title = cells[gt_title_idx] if gt_title_idx is not None else ""
             
             # Skip ET DEPT rows
             if "ET DEPT" in gt_class:
@@ -488,40 +611,34 @@ class TransferMapScraper:
             external_credit_hours = 3.0  # Default
             gt_credit_hours = 3.0  # Default
             
-            if credit_hours_indices:
+            if credit_first_idx is not None:
                 try:
-                    if len(credit_hours_indices) >= 2:
+                    if has_two_credit_columns:
                         # Two credit hour columns: left is external, right is GT
-                        external_credit_hours = float(cells[credit_hours_indices[0]].get_text(strip=True) or "3.0")
-                        gt_credit_hours = float(cells[credit_hours_indices[-1]].get_text(strip=True) or "3.0")
+                        external_credit_hours = float(cells[credit_first_idx] or "3.0")
+                        gt_credit_hours = float(cells[credit_last_idx] or "3.0")
                     else:
                         # One credit hour column: assume it's GT hours
-                        gt_credit_hours = float(cells[credit_hours_indices[0]].get_text(strip=True) or "3.0")
+                        gt_credit_hours = float(cells[credit_first_idx] or "3.0")
                         external_credit_hours = gt_credit_hours  # Default external = GT
                 except (ValueError, IndexError):
                     pass  # Keep defaults
             
-            # Normalize GT course code
-            normalized_gt_code = self.normalize_gt_course_code(gt_class)
-            
-            equivalency = {
+            append({
                 'subject': subject,
                 'schoolCourseCode': external_class,
                 'schoolCourseName': external_title,
                 'schoolCreditHours': external_credit_hours,
-                'gtCourseCode': normalized_gt_code,
+                'gtCourseCode': normalize_gt_course_code(gt_class),
                 'gtCourseName': gt_title,
                 'gtCreditHours': gt_credit_hours
-            }
-            
-            equivalencies.append(equivalency)
+            })
         
         return equivalencies
     
     def ensure_schema(self):
         """Ensure database schema exists."""
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
+        cursor = self.conn.cursor()
         
         # The schema is already provided - we just need to ensure it exists
         # But since the requirement states "tables exist; keep this exact shape",
@@ -529,95 +646,125 @@ class TransferMapScraper:
         cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
         tables = cursor.fetchall()
         logger.info(f"Database connected. Tables: {[t[0] for t in tables]}")
-        
-        conn.close()
     
     def create_school_slug(self, school_name: str) -> str:
         """Create URL-safe slug from school name."""
-        slug = re.sub(r'[^\w\s-]', '', school_name.lower())
-        slug = re.sub(r'[-\s]+', '-', slug)
+        slug = _SLUG_NONWORD_RE.sub('', school_name.lower())
+        slug = _SLUG_DASH_RE.sub('-', slug)
         return slug.strip('-')
     
     def upsert_school(self, name: str) -> int:
         """Insert or get school ID."""
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        cursor.execute("INSERT OR IGNORE INTO School (name) VALUES (?)", (name,))
-        cursor.execute("SELECT id FROM School WHERE name = ?", (name,))
-        school_id = cursor.fetchone()[0]
-        
-        conn.commit()
-        conn.close()
-        return school_id
-    
-    def upsert_gt_course(self, code: str, title: str, credit_hours: float) -> int:
-        """Insert or update GT course."""
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            INSERT OR IGNORE INTO GTCourse (code, title, creditHours) 
-            VALUES (?, ?, ?)
-        """, (code, title, credit_hours))
-        
-        cursor.execute("SELECT id FROM GTCourse WHERE code = ?", (code,))
-        course_id = cursor.fetchone()[0]
-        
-        conn.commit()
-        conn.close()
-        return course_id
-    
-    def upsert_external_course(self, school_id: int, code: str, title: str, credit_hours: float):
-        """Insert or ignore external course."""
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            INSERT OR IGNORE INTO ExternalCourse (schoolId, code, title, creditHours) 
-            VALUES (?, ?, ?, ?)
-        """, (school_id, code, title, credit_hours))
-        
-        conn.commit()
-        conn.close()
-    
-    def upsert_equivalency(self, gt_course_id: int, school_id: int, external_course_code: str, semester: str):
-        """Insert or update equivalency."""
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            INSERT INTO Equivalency (gtCourseId, schoolId, externalCourseCode, semester) 
-            VALUES (?, ?, ?, ?)
-            ON CONFLICT(gtCourseId, schoolId, externalCourseCode) 
-            DO UPDATE SET semester = excluded.semester
-        """, (gt_course_id, school_id, external_course_code, semester))
-        
-        conn.commit()
-        conn.close()
+        cursor = self.conn.cursor()
+        
+        cursor.execute(SQL_INSERT_SCHOOL, (name,))
+        cursor.execute(SQL_SELECT_SCHOOL_ID, (name,))
+        return cursor.fetchone()[0]
+    
+    def store_equivalencies(self, school_id: int, equivalencies: List[Dict[str, Any]]):
+        """Batch insert GT courses, external courses and equivalencies."""
+        if not equivalencies:
+            return
+        
+        cursor = self.conn.cursor()
+        
+        cursor.executemany(SQL_INSERT_GT_COURSE, [
+            (eq['gtCourseCode'], eq['gtCourseName'], eq['gtCreditHours']) for eq in equivalencies
+        ])
+        
+        cursor.executemany(SQL_INSERT_EXTERNAL_COURSE, [
+            (school_id, eq['schoolCourseCode'], eq['schoolCourseName'], eq['schoolCreditHours'])
+            for eq in equivalencies
+        ])
+        
+        # Resolve GT course IDs with one cached statement (an IN list would
+        # compile a new statement per distinct length and can exceed the
+        # SQLite variable limit on large schools)
+        gt_course_ids = {}
+        for code in {eq['gtCourseCode'] for eq in equivalencies}:
+            cursor.execute(SQL_SELECT_GT_COURSE_ID, (code,))
+            gt_course_ids[code] = cursor.fetchone()[0]
+        
+        cursor.executemany(SQL_UPSERT_EQUIVALENCY, [
+            (gt_course_ids[eq['gtCourseCode']], school_id, eq['schoolCourseCode'], SEMESTER)
+            for eq in equivalencies
+        ])
     
     def save_school_snapshot(self, school_name: str, equivalencies: List[Dict[str, Any]]):
         """Save JSON snapshot for a school."""
         slug = self.create_school_slug(school_name)
+        subjects_count = len({eq['subject'] for eq in equivalencies})
         
         snapshot = {
             "school": school_name,
             "semester": SEMESTER,
             "level": LEVEL,
-            "subjects_count": len(set(eq['subject'] for eq in equivalencies)),
+            "subjects_count": subjects_count,
             "equivalencies": equivalencies
         }
         
-        with open(f'../data/schools/{slug}.json', 'w') as f:
-            json.dump(snapshot, f, indent=2)
+        # Write to a temp file and rename so a crash never leaves a partial snapshot
+        snapshot_path = Path(f'../data/schools/{slug}.json')
+        tmp_path = snapshot_path.with_name(snapshot_path.name + '.tmp')
+        tmp_path.write_bytes(orjson.dumps(snapshot, option=orjson.OPT_INDENT_2))
+        os.replace(tmp_path, snapshot_path)
         
         logger.info(f"Saved snapshot for {school_name}: {len(equivalencies)} equivalencies")
     
+    def scrape_school(self, schools_url: str, school_value: str, school_name: str,
+                      subject_pool: ThreadPoolExecutor) -> List[Dict[str, Any]]:
+        """Fetch and parse all equivalencies for one school (runs on a worker thread, no DB access)."""
+        logger.info(f"Processing school: {school_name}")
+        
+        # Step 4: Choose school
+        subject_url = self.step_choose_school(schools_url, school_value, school_name)
+        
+        # Step 5: Get subjects and the subject submission form
+        subjects, subject_field, post_url, form_data = self.step_subject_level_term(subject_url)
+        
+        logger.info(f"Found {len(subjects)} subjects for {school_name}")
+        
+        all_equivalencies = []
+        
+        # Fetch subjects concurrently; results are collected in submission order
+        futures = [
+            (subject_name, subject_pool.submit(self.scrape_subject, post_url, form_data,
+                                               subject_field, subject_value, subject_name, school_value))
+            for subject_value, subject_name in subjects
+        ]
+        
+        # Process each subject
+        for subject_name, future in tqdm(futures, desc=f"Subjects for {school_name}", leave=False):
+            try:
+                equivalencies = future.result()
+                
+                all_equivalencies.extend(equivalencies)
+                
+                if equivalencies:
+                    logger.info(f"  {subject_name}: {len(equivalencies)} equivalencies")
+            
+            except ScraperStopped:
+                # Drop this school's queued subjects rather than leaving them on the pool
+                for _, pending in futures:
+                    pending.cancel()
+                raise
+            
+            except Exception as e:
+                logger.error(f"Error processing subject {subject_name} for {school_name}: {e}")
+                continue
+        
+        return all_equivalencies
+    
     def run(self):
         """Main scraper execution."""
         logger.info("Starting TransferMap GT scraper...")
         logger.info(f"Target: {STATE_NAME} schools, {LEVEL} level, {SEMESTER}")
         
+        school_pool = ThreadPoolExecutor(max_workers=SCHOOL_WORKERS)
+        subject_pool = ThreadPoolExecutor(max_workers=SUBJECT_WORKERS)
+        futures = {}
+        finished = False
+        
         try:
             # Step 1: Answer US question
             logger.info("Step 1: Answering US institution question...")
@@ -633,68 +780,27 @@ class TransferMapScraper:
             
             logger.info(f"Processing {len(schools)} schools...")
             
-            # Process each school
-            for school_value, school_name in tqdm(schools, desc="Schools"):
+            # Scrape schools concurrently; all requests share self.limiter
+            futures = {
+                school_pool.submit(self.scrape_school, schools_url, school_value, school_name, subject_pool): school_name
+                for school_value, school_name in schools
+            }
+            
+            # This thread is the only database writer
+            for future in tqdm(as_completed(futures), total=len(futures), desc="Schools"):
+                school_name = futures[future]
                 try:
-                    logger.info(f"Processing school: {school_name}")
+                    all_equivalencies = future.result()
                     
-                    # Step 4: Choose school
-                    subject_url = self.step_choose_school(schools_url, school_value, school_name)
-                    
-                    # Step 5: Get subjects and form field names
-                    base_url, subjects, subject_field, level_field, term_field = self.step_subject_level_term(subject_url)
-                    
-                    logger.info(f"Found {len(subjects)} subjects for {school_name}")
-                    
-                    # Upsert school
-                    school_id = self.upsert_school(school_name)
-                    
-                    all_equivalencies = []
-                    
-                    # Process each subject
-                    for subject_value, subject_name in tqdm(subjects, desc=f"Subjects for {school_name}", leave=False):
-                        try:
-                            # Submit subject and get equivalency table
-                            html_content = self.submit_subject(base_url, subject_value, subject_field, level_field, term_field)
-                            
-                            # Parse equivalencies
-                            equivalencies = self.parse_equivalency_table(html_content, subject_name)
-                            
-                            # Store in database
-                            for eq in equivalencies:
-                                # Upsert GT course
-                                gt_course_id = self.upsert_gt_course(
-                                    eq['gtCourseCode'], 
-                                    eq['gtCourseName'], 
-                                    eq['gtCreditHours']
-                                )
-                                
-                                # Upsert external course
-                                self.upsert_external_course(
-                                    school_id,
-                                    eq['schoolCourseCode'],
-                                    eq['schoolCourseName'],
-                                    eq['schoolCreditHours']
-                                )
-                                
-                                # Upsert equivalency
-                                self.upsert_equivalency(
-                                    gt_course_id,
-                                    school_id,
-                                    eq['schoolCourseCode'],
-                                    SEMESTER
-                                )
-                            
-                            all_equivalencies.extend(equivalencies)
-                            
-                            if equivalencies:
-                                logger.info(f"  {subject_name}: {len(equivalencies)} equivalencies")
+                    # Everything written for this school commits in one transaction
+                    with self.conn:
+                        # Upsert school
+                        school_id = self.upsert_school(school_name)
                         
-                        except Exception as e:
-                            logger.error(f"Error processing subject {subject_name} for {school_name}: {e}")
-                            continue
+                        # Store in database, one batch per table for the whole school
+                        self.store_equivalencies(school_id, all_equivalencies)
                     
-                    # Save school snapshot
+                    # Save school snapshot once the database commit has succeeded
                     if all_equivalencies:
                         self.save_school_snapshot(school_name, all_equivalencies)
                     
@@ -703,11 +809,24 @@ class TransferMapScraper:
                 except Exception as e:
                     logger.error(f"Error processing school {school_name}: {e}")
                     continue
+            
+            finished = True
         
         except Exception as e:
             logger.error(f"Fatal error in scraper: {e}")
             raise
         
+        finally:
+            if not finished:
+                # Interrupted (e.g. Ctrl-C) or failed: drop queued schools and make
+                # in-flight workers bail out at their next request instead of draining
+                self.stop_event.set()
+                for future in futures:
+                    future.cancel()
+            school_pool.shutdown(wait=finished)
+            subject_pool.shutdown(wait=finished)
+            self.conn.close()
+        
         logger.info("Scraper completed successfully!")
 
 